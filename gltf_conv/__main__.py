@@ -1,32 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
 from importlib import resources
-import json
 import os
 import argparse
-import copy
 import shutil
 from typing import Literal
 
 from gltf_conv import __version__
 from gltf_conv.conv_spec import ConvSpec
-from gltf_conv.dxspec_material_utils import (
-    DXSpec_Mat2TextureContainer,
-    DXSpec_Material,
-    DXSpec_TextureKeysContainer,
-    DXSpec_TextureSpecContainer,
-)
+from gltf_conv.dxspec_material_utils import DXSpec_Material, DXSpec_PipelineBuilder
 from gltf_conv.dxtf_material_utils import DXTF_Material, DXTF_Tex2DDS
 from gltf_conv.gltf_material_utils import GLTF_Material
 from gltf_conv.gltf_src import GLTFSrc
 from gltf_conv.schema_registry import get_validator
-from gltf_conv.utils import ezlog, recursive_overwrite
+from gltf_conv.utils import copy_file, ezlog, json_clone, recursive_overwrite, to_posix, write_json
+
+_MANIFEST_VALIDATOR = get_validator( 'dxtf_mdm.schema.json' )
 
 def parse_materials( gltf_srcs: list[GLTFSrc], conv_spec: ConvSpec ):
 
-    # Create mutable copy of material_spec_overrides
-    material_spec_overrides: dict[str, dict] = copy.deepcopy( conv_spec.material_spec_overrides )
+    # Create mutable copy of material_spec_overrides, excluding the global override
+    material_spec_overrides: dict[str, dict] = {
+        k: json_clone( v ) for k, v in conv_spec.material_spec_overrides.items() if k != '*'
+    }
 
-    # Pop the global override (if exists)
-    material_spec_override_global: dict = material_spec_overrides.pop( '*', {} )
+    # Get the global override (if exists), which is only read from and shared between materials
+    material_spec_override_global: dict = conv_spec.material_spec_overrides.get( '*', {} )
 
     # Create empty container for dxspec materials
     dxspec_material_db: dict[str, DXSpec_Material] = {}
@@ -82,37 +80,56 @@ def write_manifest( conv_spec: ConvSpec, gltf_srcs: list[GLTFSrc] ):
     }
     for gltf_src in gltf_srcs:
         manifest_dict['models'].append( { 'name': gltf_src.name, 'file': gltf_src.file + '.dxtf_mds' } )
-    with open( manifest_path, 'w', encoding='utf-8' ) as f:
-        validator = get_validator( 'dxtf_mdm.schema.json' )
-        validator.validate( manifest_dict )
-        json.dump( manifest_dict, f, indent=2 )
+    _MANIFEST_VALIDATOR.validate( manifest_dict )
+    write_json( manifest_path, manifest_dict, indent=True )
     ezlog.info( f'Wrote manifest to "{conv_spec.name}.dxtf_mdm"!' )
 
-def main( file_path: str, verbose: list[str], model_move: Literal['copy', 'move'] ):
+def write_mesh( conv_spec: ConvSpec, gltf_src: GLTFSrc, model_move: Literal['copy', 'move'], link: bool ):
+    dxtf_path = os.path.join( conv_spec.out_dir, gltf_src.file + '.dxtf_mds' )
+    write_json( dxtf_path, gltf_src.as_dxtf() )
+    ezlog.info( f'Wrote "{gltf_src.name}" struct to "{gltf_src.file}.dxtf_mds"!' )
+
+    bin_path = os.path.join( gltf_src.src_dir, gltf_src.file + '.comp.bin' )
+    mdl_path = os.path.join( conv_spec.out_dir, gltf_src.file + '.dxtf_mdl' )
+    if model_move == 'move':
+        shutil.move( bin_path, mdl_path )
+    else:
+        # Unlink the old output first, it may be a hardlink to bin_path from a previous --link run
+        if os.path.lexists( mdl_path ):
+            os.remove( mdl_path )
+        if link:
+            try:
+                os.link( bin_path, mdl_path )
+            except OSError as e:
+                # e.g. EXDEV across devices, or no hardlink support on the file system
+                ezlog.warning( f'Could not hardlink "{gltf_src.file}.comp.bin" ({e.strerror}), copying instead!' )
+                link = False
+        if not link:
+            copy_file( bin_path, mdl_path )
+    ezlog.info( f'Wrote "{gltf_src.name}" binary to "{gltf_src.file}.dxtf_mdl"!' )
+
+def main( file_path: str, verbose: list[str], model_move: Literal['copy', 'move'], link: bool = False ):
 
     # Load conversion spec
     conv_spec = ConvSpec.from_file( file_path )
 
     # Set CWD to file_path's parent
-    os.chdir( cwd := os.path.dirname( os.path.abspath( file_path ) ).replace( '\\', '/' ) )
+    os.chdir( cwd := to_posix( os.path.dirname( os.path.abspath( file_path ) ) ) )
     ezlog.warning( f'Setting CWD to "{cwd}"!\n' )
 
-    # Iterate over all .gltf files and construct a src object
-    gltf_srcs = [ GLTFSrc( conv_spec.src_dir, src, 'gltfpack' in verbose ) for src in conv_spec.srcs ]
+    # Iterate over all .gltf files and construct a src object, running gltfpack for all sources in parallel
+    with ThreadPoolExecutor( max_workers=os.cpu_count() ) as executor:
+        gltf_srcs = list( executor.map( lambda src: GLTFSrc( conv_spec.src_dir, src, 'gltfpack' in verbose ), conv_spec.srcs ) )
     print()
 
     # Parse all GLTF materials and return a dict of dxspec materials
     dxspec_material_db = parse_materials( gltf_srcs, conv_spec )
     print()
 
-    # Create bi-map of image texture assembly keys to material names
-    dxspec_texture_keys_db = DXSpec_TextureKeysContainer( dxspec_material_db )
-
-    # Create bi-map of image texture assembly keys to DDS texture filenames
-    dxspec_texture_outs_db = DXSpec_TextureSpecContainer( dxspec_texture_keys_db )
-
-    # Create map of material names to DDS texture filenames
-    dxspec_mat2textures_db = DXSpec_Mat2TextureContainer( dxspec_texture_keys_db, dxspec_texture_outs_db )
+    # Create bi-map of image texture assembly keys to DDS texture filenames and map of material names to DDS texture filenames
+    dxspec_pipeline = DXSpec_PipelineBuilder( dxspec_material_db )
+    dxspec_texture_outs_db = dxspec_pipeline.texture_outs_db
+    dxspec_mat2textures_db = dxspec_pipeline.mat2textures_db
 
     # Create list of DXTF materials from dxspec materials and material name map
     dxtf_materials_db = DXTF_Material.list_from_texture_specs( dxspec_material_db, dxspec_mat2textures_db, 'dxtf_mats' in verbose )
@@ -125,21 +142,28 @@ def main( file_path: str, verbose: list[str], model_move: Literal['copy', 'move'
     dxtf_tex2dds_db = DXTF_Tex2DDS.list_from_texture_specs( dxspec_texture_outs_db, conv_spec.dx_textures_path, conv_spec.tex2dds_settings, 'tex2dds_spec' in verbose )
     print()
 
-    # Write DDS textures to disk
-    DXTF_Tex2DDS.write_textures( dxtf_tex2dds_db, conv_spec.dx_textures_path, 'tex2dds' in verbose )
-    print()
-
-    ezlog.info( f'Writing DXTF meshes to "{conv_spec.out_dir}"' )
-    for gltf_src in gltf_srcs:
-        dxtf_path = os.path.join( conv_spec.out_dir, gltf_src.file + '.dxtf_mds' )
-        with open( dxtf_path, 'w', encoding='utf-8' ) as f:
-            json.dump( gltf_src.as_dxtf(), f )
-            ezlog.info( f'Wrote "{gltf_src.name}" struct to "{gltf_src.file}.dxtf_mds"!' )
-        shutil.copy(
-            os.path.join( gltf_src.src_dir, gltf_src.file + '.comp.bin' ),
-            os.path.join( conv_spec.out_dir, gltf_src.file + '.dxtf_mdl' ),
-        )
-        ezlog.info( f'Wrote "{gltf_src.name}" binary to "{gltf_src.file}.dxtf_mdl"!' )
+    # Write DDS textures to disk in the background, on their own worker so meshes never queue behind tex2dds
+    with ThreadPoolExecutor( max_workers=1 ) as textures_executor:
+        textures_future = textures_executor.submit( DXTF_Tex2DDS.write_textures, dxtf_tex2dds_db, conv_spec.dx_textures_path, 'tex2dds' in verbose )
+
+        # Moving consumes the compressed sources, so only do so once the DDS textures succeeded
+        if model_move == 'move':
+            textures_future.result()
+
+        # Write DXTF meshes to disk while the DDS textures are being written
+        ezlog.info( f'Writing DXTF meshes to "{conv_spec.out_dir}"' )
+        mesh_error: Exception | None = None
+        try:
+            with ThreadPoolExecutor( max_workers=os.cpu_count() ) as executor:
+                list( executor.map( lambda gltf_src: write_mesh( conv_spec, gltf_src, model_move, link ), gltf_srcs ) )
+        except Exception as e:
+            mesh_error = e
+
+        # Wait for DDS textures to finish, reporting a tex2dds failure even if a mesh write failed too
+        if textures_error := textures_future.exception():
+            raise textures_error from mesh_error
+        if mesh_error:
+            raise mesh_error
     print()
 
     write_manifest( conv_spec, gltf_srcs )
@@ -191,6 +215,7 @@ if __name__ == '__main__':
 
     arg_parser.add_argument( 'file', type=str, help='path to json file specifying conversion configuration.' )
     arg_parser.add_argument( '-m', '--model', type=str, choices=[ 'copy', 'move' ], default='copy', help='if the compressed GLTF .bin should be copied or moved' )
+    arg_parser.add_argument( '-l', '--link', action='store_true', help='hardlink the compressed GLTF .bin instead of copying it, falling back to a copy if linking fails. Not allowed with --model move' )
 
     arg_parser.add_argument(
         '-v', '--verbose',
@@ -212,4 +237,6 @@ if __name__ == '__main__':
         help='prints the names of all schemas, or prints the specified schema to console' )
 
     arguments = arg_parser.parse_args()
-    main( arguments.file, arguments.verbose, arguments.model )
+    if arguments.link and arguments.model == 'move':
+        arg_parser.error( 'argument -l/--link: not allowed with --model move' )
+    main( arguments.file, arguments.verbose, arguments.model, arguments.link )
@@ -1,9 +1,11 @@
 
 from dataclasses import dataclass, field
+from functools import cached_property
 import json
 import os
 
-from gltf_conv.schema_registry import get_validator
+from gltf_conv.schema_registry import validate
+from gltf_conv.utils import to_posix
 
 @dataclass
 class ConvSpec:
@@ -21,18 +23,17 @@ class ConvSpec:
     material_spec_overrides: dict = field( default_factory=dict )
 
 
-    @property
+    @cached_property
     def dx_textures_path( self ) -> str:
-        return os.path.join( self.out_dir, self.dx_textures_subdir ).replace( '\\', '/' )
+        return to_posix( os.path.join( self.out_dir, self.dx_textures_subdir ) )
 
-    @property
+    @cached_property
     def dx_materials_path( self ) -> str:
-        return os.path.join( self.out_dir, self.dx_materials_subdir ).replace( '\\', '/' )
+        return to_posix( os.path.join( self.out_dir, self.dx_materials_subdir ) )
 
     @classmethod
     def from_dict( cls, obj: dict ) -> 'ConvSpec':
-        validator = get_validator( 'conv_spec.schema.json' )
-        validator.validate( obj )
+        validate( 'conv_spec.schema.json', obj )
         return cls( **obj )
 
     @classmethod
@@ -1,21 +1,49 @@
 from dataclasses import dataclass, field
+import functools
 from pathlib import Path
 from types import NoneType
-from typing import ClassVar, DefaultDict, Optional, TypeAlias
+from typing import ClassVar, Iterator, Optional, TypeAlias
 
 from gltf_conv.gltf_material_utils import GLTF_Material, GLTF_NormalTexture, GLTF_OcclusionTexture, GLTF_PBRMetallicRoughness
 from gltf_conv.gltf_src import GLTFSrc
-from gltf_conv.utils import BlendModes, DDSFormat, modulate
+from gltf_conv.utils import BlendModes, DDSFormat, ezlog, modulate, to_posix
 
 
-DXSpec_TextureKey: TypeAlias = tuple[tuple[tuple[Optional[Path], str], ...], DDSFormat, tuple[int, int]]
+DXSpec_TextureSubKey: TypeAlias = tuple[Optional[Path], str]
+DXSpec_TextureKey: TypeAlias = tuple[tuple[DXSpec_TextureSubKey, ...], DDSFormat, tuple[int, int]]
 
-@dataclass
+# Shared instances of texture keys and sub keys, so materials using the same textures share one tuple
+_KEY_CACHE: dict[tuple, tuple] = {}
+
+def _intern( t: tuple ) -> tuple:
+    return _KEY_CACHE.setdefault( t, t )
+
+@functools.lru_cache( maxsize=None )
+def _stem_dds( uri: Path ) -> str:
+    return to_posix( uri.stem + '.dds' )
+
+@dataclass( slots=True )
 class DXSpec_TextureInfo:
     uri: Path | None
     swizzle: str
 
-@dataclass
+    def get_texture_sub_key( self ) -> DXSpec_TextureSubKey:
+        return _intern( ( self.uri, self.swizzle ) )
+
+    def _apply_override( self, override: dict | None, uri_swizzle: str, strength_key: str ):
+        if not override:
+            return
+
+        if unknown := override.keys() - { 'uri', strength_key }:
+            raise ValueError( f'Unknown overrides: { { k: override[k] for k in unknown } }' )
+
+        if 'uri' in override:
+            self.uri = override[ 'uri' ]
+            self.swizzle = uri_swizzle
+        if strength_key in override:
+            setattr( self, strength_key, modulate( getattr( self, strength_key ), override[ strength_key ] ) )
+
+@dataclass( slots=True )
 class DXSpec_NormalTexture( DXSpec_TextureInfo ):
     scale: float
 
@@ -30,21 +58,13 @@ class DXSpec_NormalTexture( DXSpec_TextureInfo ):
             self.swizzle = 'rg'
             self.scale = obj.scale
 
-        if override:
-            if 'uri' in override:
-                self.uri = override.pop( 'uri' )
-                self.swizzle = 'rg'
-            if 'scale' in override:
-                self.scale = modulate( self.scale, override.pop( 'scale' ) )
-
-            if len( override ) > 0:
-                raise ValueError( f'Unknown overrides: {override}' )
+        self._apply_override( override, 'rg', 'scale' )
 
 
     def get_texture_key( self, resolution: tuple[int, int] ) -> DXSpec_TextureKey:
-        return ( ( ( self.uri, self.swizzle ), ), 'BC5_UNORM', resolution )
+        return _intern( ( ( self.get_texture_sub_key(), ), 'BC5_UNORM', resolution ) )
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_OcclusionTexture( DXSpec_TextureInfo ):
     strength: float
 
@@ -59,17 +79,9 @@ class DXSpec_OcclusionTexture( DXSpec_TextureInfo ):
             self.swizzle = 'r'
             self.strength = obj.strength
 
-        if override:
-            if 'uri' in override:
-                self.uri = override.pop( 'uri' )
-                self.swizzle = 'r'
-            if 'strength' in override:
-                self.strength = modulate( self.strength, override.pop( 'strength' ) )
-
-            if len( override ) > 0:
-                raise ValueError( f'Unknown overrides: {override}' )
+        self._apply_override( override, 'r', 'strength' )
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_RoughnessTexture( DXSpec_TextureInfo ):
     strength: float
 
@@ -92,17 +104,9 @@ class DXSpec_RoughnessTexture( DXSpec_TextureInfo ):
                 self.swizzle = '1'
                 self.strength = obj.roughness_factor or self.default_strength
 
-        if override:
-            if 'uri' in override:
-                self.uri = override.pop( 'uri' )
-                self.swizzle = 'g'
-            if 'strength' in override:
-                self.strength = modulate( self.strength, override.pop( 'strength' ) )
-
-            if len( override ) > 0:
-                raise ValueError( f'Unknown overrides: {override}' )
+        self._apply_override( override, 'g', 'strength' )
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_MetalnessTexture( DXSpec_TextureInfo ):
     strength: float
 
@@ -125,17 +129,9 @@ class DXSpec_MetalnessTexture( DXSpec_TextureInfo ):
                 self.swizzle = '1'
                 self.strength = obj.metallic_factor or self.default_strength
 
-        if override:
-            if 'uri' in override:
-                self.uri = override.pop( 'uri' )
-                self.swizzle = 'b'
-            if 'strength' in override:
-                self.strength = modulate( self.strength, override.pop( 'strength' ) )
-
-            if len( override ) > 0:
-                raise ValueError( f'Unknown overrides: {override}' )
+        self._apply_override( override, 'b', 'strength' )
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_DiffuseTexture( DXSpec_TextureInfo ):
     strength: tuple[float, float, float, float]
 
@@ -156,24 +152,16 @@ class DXSpec_DiffuseTexture( DXSpec_TextureInfo ):
                 self.swizzle = '1111'
                 self.strength = obj.base_color_factor
 
-        if override:
-            if 'uri' in override:
-                self.uri = override.pop( 'uri' )
-                self.swizzle = 'rgb1' if alpha_mode == 'OPAQUE' else 'rgba'
-            if 'strength' in override:
-                self.strength = modulate( self.strength, override.pop( 'strength' ) )
-
-            if len( override ) > 0:
-                raise ValueError( f'Unknown overrides: {override}' )
+        self._apply_override( override, 'rgb1' if alpha_mode == 'OPAQUE' else 'rgba', 'strength' )
 
     def get_texture_key( self, resolution: tuple[int, int] ) -> DXSpec_TextureKey:
-        return (
-            ( ( self.uri, self.swizzle ), ),
+        return _intern( (
+            ( self.get_texture_sub_key(), ),
             'BC1_UNORM_SRGB' if self.swizzle[-1] == '1' else 'BC3_UNORM_SRGB',
             resolution
-        )
+        ) )
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_OcclusionRoughnessMetalness:
     occlusion: DXSpec_OcclusionTexture
     roughness: DXSpec_RoughnessTexture
@@ -187,9 +175,9 @@ class DXSpec_OcclusionRoughnessMetalness:
 
     def get_texture_key( self, resolution: tuple[int, int] ) -> DXSpec_TextureKey:
         texs: list[DXSpec_TextureInfo] = [ self.occlusion, self.roughness, self.metalness ]
-        return ( tuple( ( tex.uri, tex.swizzle ) for tex in texs ), 'BC7_UNORM', resolution )
+        return _intern( ( tuple( tex.get_texture_sub_key() for tex in texs ), 'BC7_UNORM', resolution ) )
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_EmissiveTexture( DXSpec_TextureInfo ):
     factor: tuple[float, float, float]
 
@@ -205,20 +193,12 @@ class DXSpec_EmissiveTexture( DXSpec_TextureInfo ):
         elif override is None:
             raise ValueError( 'Cannot construct emissive texture if neither texture nor factor specified!' )
 
-        if override:
-            if 'uri' in override:
-                self.uri = override.pop( 'uri' )
-                self.swizzle = 'rgb'
-            if 'factor' in override:
-                self.factor = modulate( self.factor, override.pop( 'factor' ) )
-
-            if len( override ) > 0:
-                raise ValueError( f'Unknown overrides: {override}' )
+        self._apply_override( override, 'rgb', 'factor' )
 
     def get_texture_key( self, resolution: tuple[int, int] ) -> DXSpec_TextureKey:
-        return ( ( ( self.uri, self.swizzle ), ), 'BC6H_UF16', resolution ) # TODO: yay or nay?
+        return _intern( ( ( self.get_texture_sub_key(), ), 'BC6H_UF16', resolution ) ) # TODO: yay or nay?
 
-@dataclass
+@dataclass( slots=True )
 class DXSpec_Material:
     name: str
 
@@ -233,6 +213,13 @@ class DXSpec_Material:
 
     resolution: tuple[int, int]
 
+    src_file: str
+
+    _diffuse_key: Optional[DXSpec_TextureKey] = field( repr=False, compare=False )
+    _normal_key: Optional[DXSpec_TextureKey] = field( repr=False, compare=False )
+    _orm_key: Optional[DXSpec_TextureKey] = field( repr=False, compare=False )
+    _emissive_key: Optional[DXSpec_TextureKey] = field( repr=False, compare=False )
+
     def __init__( self, obj: GLTF_Material, src: GLTFSrc, override: dict | None ):
         override = override or {}
 
@@ -263,75 +250,41 @@ class DXSpec_Material:
         if len( override ) > 0:
             raise ValueError( f'Unknown overrides: {override}' )
 
+        # Textures and resolution are fixed from here on, so compute the texture keys once
+        self._diffuse_key = self.diffuse.get_texture_key( self.resolution )
+        self._normal_key = self.normal.get_texture_key( self.resolution )
+        self._orm_key = self.orm.get_texture_key( self.resolution )
+        self._emissive_key = self.emissive.get_texture_key( self.resolution ) if self.emissive else None
+
 
     def get_diffuse_texture_key( self ) -> DXSpec_TextureKey | None:
-        return self.diffuse.get_texture_key( self.resolution )
+        return self._diffuse_key
 
     def get_normal_texture_key( self ) -> DXSpec_TextureKey | None:
-        return self.normal.get_texture_key( self.resolution )
+        return self._normal_key
 
     def get_orm_texture_key( self ) -> DXSpec_TextureKey | None:
-        return self.orm.get_texture_key( self.resolution )
+        return self._orm_key
 
     def get_emissive_texture_key( self ) -> DXSpec_TextureKey | None:
-        return self.emissive.get_texture_key( self.resolution ) if self.emissive else None
-
-class DXSpec_TextureKeysContainer:
-    @dataclass
-    class _Key2List:
-        diffuse: DefaultDict[DXSpec_TextureKey, list[str]] = field( default_factory=lambda: DefaultDict( list[str] ) )
-        normal: DefaultDict[DXSpec_TextureKey, list[str]] = field( default_factory=lambda: DefaultDict( list[str] ) )
-        orm: DefaultDict[DXSpec_TextureKey, list[str]] = field( default_factory=lambda: DefaultDict( list[str] ) )
-        emissive: DefaultDict[DXSpec_TextureKey, list[str]] = field( default_factory=lambda: DefaultDict( list[str] ) )
-
-    @dataclass
-    class _Str2Key:
-        diffuse: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-        normal: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-        orm: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-        emissive: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-
-    def __init__( self, dxspec_material_db: dict[str, DXSpec_Material] ):
-
-        # Image texture key to list of material names
-        self.key2list = self._Key2List()
-
-        # Material name to image texture key
-        self.str2key = self._Str2Key()
-
-        # Map image texture key to list of material names
-        for mat_name, spec_mat in dxspec_material_db.items():
-            if( diff_key := spec_mat.get_diffuse_texture_key() ):
-                self.key2list.diffuse[diff_key].append( mat_name )
-            if( norm_key := spec_mat.get_normal_texture_key() ):
-                self.key2list.normal[norm_key].append( mat_name )
-            if( orm_key := spec_mat.get_orm_texture_key() ):
-                self.key2list.orm[orm_key].append( mat_name )
-            if( em_key := spec_mat.get_emissive_texture_key() ):
-                self.key2list.emissive[em_key].append( mat_name )
-
-        # Map material name to image texture key
-        self.str2key.diffuse = { v: k for k, vs in self.key2list.diffuse.items() for v in vs }
-        self.str2key.normal = { v: k for k, vs in self.key2list.normal.items() for v in vs }
-        self.str2key.orm = { v: k for k, vs in self.key2list.orm.items() for v in vs }
-        self.str2key.emissive = { v: k for k, vs in self.key2list.emissive.items() for v in vs }
+        return self._emissive_key
 
 class DXSpec_TextureSpecContainer:
-    @dataclass
     class _Key2Str:
-        diffuse: dict[DXSpec_TextureKey, str] = field( default_factory=dict )
-        normal: dict[DXSpec_TextureKey, str] = field( default_factory=dict )
-        orm: dict[DXSpec_TextureKey, str] = field( default_factory=dict )
-        emissive: dict[DXSpec_TextureKey, str] = field( default_factory=dict )
+        def __init__( self ):
+            self.diffuse: dict[DXSpec_TextureKey, str] = {}
+            self.normal: dict[DXSpec_TextureKey, str] = {}
+            self.orm: dict[DXSpec_TextureKey, str] = {}
+            self.emissive: dict[DXSpec_TextureKey, str] = {}
 
-    @dataclass
     class _Str2Key:
-        diffuse: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-        normal: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-        orm: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
-        emissive: dict[str, DXSpec_TextureKey] = field( default_factory=dict )
+        def __init__( self ):
+            self.diffuse: dict[str, DXSpec_TextureKey] = {}
+            self.normal: dict[str, DXSpec_TextureKey] = {}
+            self.orm: dict[str, DXSpec_TextureKey] = {}
+            self.emissive: dict[str, DXSpec_TextureKey] = {}
 
-    def __init__( self, dxspec_texture_keys_db: DXSpec_TextureKeysContainer ):
+    def __init__( self ):
 
         # Image texture key to DDS texture name
         self.key2str = self._Key2Str()
@@ -339,25 +292,44 @@ class DXSpec_TextureSpecContainer:
         # DDS texture name to image texture key
         self.str2key = self._Str2Key()
 
-        key2list = dxspec_texture_keys_db.key2list
-        for texture_keys, default, texture_outs, texture_outs_inv in [
-            ( key2list.diffuse, '$DEFAULT_DIFFUSE', self.str2key.diffuse, self.key2str.diffuse ),
-            ( key2list.normal, '$DEFAULT_NORMAL', self.str2key.normal, self.key2str.normal ),
-            ( key2list.orm, '$DEFAULT_ORM', self.str2key.orm, self.key2str.orm ),
-            ( key2list.emissive, '$DEFAULT_EMISSIVE', self.str2key.emissive, self.key2str.emissive ),
-        ]:
-            for key in texture_keys.keys():
-                key_name_fold = self.name_fold( key, default )
-
-                if key_name_fold not in texture_outs:
-                    texture_outs[ key_name_fold ] = key
-                else:
-                    raise ValueError( 'Outname already exists!!' )
-
-                if key not in texture_outs_inv:
-                    texture_outs_inv[ key ] = key_name_fold
+    def fold_key(
+        self,
+        key: DXSpec_TextureKey,
+        default: str,
+        texture_outs: dict[str, DXSpec_TextureKey],
+        texture_outs_inv: dict[DXSpec_TextureKey, str]
+    ) -> str:
+        # Keys already folded map to the same DDS texture name
+        if key in texture_outs_inv:
+            return texture_outs_inv[ key ]
+
+        key_name_fold = self.name_fold( key, default )
+
+        if key_name_fold not in texture_outs:
+            texture_outs[ key_name_fold ] = key
+        else:
+            raise ValueError( 'Outname already exists!!' )
+
+        texture_outs_inv[ key ] = key_name_fold
+        return key_name_fold
+
+    def iter_tex2dds_inputs( self, tex2dds_settings: dict ) -> Iterator[tuple[str, DXSpec_TextureKey, str, bool]]:
+        """ Yields ( DDS texture name, texture key, srgb, invert_g ) for every DDS texture that must be written """
+        str2key = self.str2key
+        for texture_outs, channel in (
+            ( str2key.diffuse, 'diffuse' ),
+            ( str2key.normal, 'normal' ),
+            ( str2key.orm, 'orm' ),
+            ( str2key.emissive, 'emissive' )
+        ):
+            settings = tex2dds_settings[channel]
+            srgb = settings['srgb']
+            invert_g = settings.get( 'invert_g', False )
+            for k, v in texture_outs.items():
+                if '$' in k:
+                    ezlog.warning( f'Skipping creation of DXTF_Tex2DDS for "{k}"' )
                 else:
-                    raise ValueError( 'Outname inverse already exists!!' )
+                    yield k, v, srgb, invert_g
 
     def name_fold( self, key: DXSpec_TextureKey, default: str ):
         paths = [ sub_key[0] for sub_key in key[0] if sub_key[0] is not None ]
@@ -366,17 +338,44 @@ class DXSpec_TextureSpecContainer:
             return default # TODO: check 1111/hh/111/111
 
         # Check if all paths are the same
-        if len( set( paths ) ) == 1:
-            return ( paths[0].stem + '.dds' ).replace( "\\", "/" )
+        first = paths[0]
+        for path in paths[1:]:
+            if path != first:
+                raise ValueError( f'Cannot fold {key}' )
 
-        raise ValueError( f'Cannot fold {key}' )
+        return _stem_dds( first )
 
 class DXSpec_Mat2TextureContainer:
-    def __init__( self, dxspec_texture_keys_db: DXSpec_TextureKeysContainer, dxspec_texture_outs_db: DXSpec_TextureSpecContainer ):
-        tex_outs = dxspec_texture_outs_db.key2str
-        tex_keys = dxspec_texture_keys_db.str2key
-
-        self.diffuse: dict[str, str] = { k: tex_outs.diffuse[v] for k, v in tex_keys.diffuse.items() }
-        self.normal: dict[str, str] = { k: tex_outs.normal[v] for k, v in tex_keys.normal.items() }
-        self.orm: dict[str, str] = { k: tex_outs.orm[v] for k, v in tex_keys.orm.items() }
-        self.emissive: dict[str, str] = { k: tex_outs.emissive[v] for k, v in tex_keys.emissive.items() }
\ No newline at end of file
+    def __init__( self ):
+        self.diffuse: dict[str, str] = {}
+        self.normal: dict[str, str] = {}
+        self.orm: dict[str, str] = {}
+        self.emissive: dict[str, str] = {}
+
+    def get_all( self, name: str ) -> tuple[str, str, str, str | None]:
+        """ Returns the diffuse, normal, ORM and emissive (if any) DDS texture names for a material """
+        return self.diffuse[name], self.normal[name], self.orm[name], self.emissive.get( name )
+
+class DXSpec_PipelineBuilder:
+    """ Builds the DDS texture specs and the material to DDS texture map in a single pass over the material db """
+
+    def __init__( self, dxspec_material_db: dict[str, DXSpec_Material] ):
+
+        # Bi-map of image texture assembly keys to DDS texture filenames
+        self.texture_outs_db = DXSpec_TextureSpecContainer()
+
+        # Map of material names to DDS texture filenames
+        self.mat2textures_db = DXSpec_Mat2TextureContainer()
+
+        outs = self.texture_outs_db
+        mat2tex = self.mat2textures_db
+
+        for mat_name, spec_mat in dxspec_material_db.items():
+            if( diff_key := spec_mat.get_diffuse_texture_key() ):
+                mat2tex.diffuse[mat_name] = outs.fold_key( diff_key, '$DEFAULT_DIFFUSE', outs.str2key.diffuse, outs.key2str.diffuse )
+            if( norm_key := spec_mat.get_normal_texture_key() ):
+                mat2tex.normal[mat_name] = outs.fold_key( norm_key, '$DEFAULT_NORMAL', outs.str2key.normal, outs.key2str.normal )
+            if( orm_key := spec_mat.get_orm_texture_key() ):
+                mat2tex.orm[mat_name] = outs.fold_key( orm_key, '$DEFAULT_ORM', outs.str2key.orm, outs.key2str.orm )
+            if( em_key := spec_mat.get_emissive_texture_key() ):
+                mat2tex.emissive[mat_name] = outs.fold_key( em_key, '$DEFAULT_EMISSIVE', outs.str2key.emissive, outs.key2str.emissive )
@@ -1,10 +1,13 @@
-from dataclasses import dataclass, asdict
-import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import errno
 import os
 from pathlib import Path
 import subprocess
 from typing import Optional
 
+import orjson
+
 from gltf_conv.schema_registry import get_validator
 from gltf_conv.dxspec_material_utils import (
     DXSpec_Mat2TextureContainer,
@@ -12,32 +15,32 @@ from gltf_conv.dxspec_material_utils import (
     DXSpec_TextureKey,
     DXSpec_TextureSpecContainer
 )
-from gltf_conv.utils import BlendModes, DDSFormat, ezlog, format_get_channels
+from gltf_conv.utils import BlendModes, DDSFormat, ezlog, format_get_channels, to_posix, write_json
 
 
-@dataclass
+@dataclass( slots=True )
 class DXTF_DiffuseTexture:
     texture: str
     strength: tuple[float, float, float, float]
 
-@dataclass
+@dataclass( slots=True )
 class DXTF_NormalTexture:
     texture: str
     strength: float
 
-@dataclass
+@dataclass( slots=True )
 class DXTF_ORMTexture:
     texture: str
     occlusion_strength: float
     roughness_strength: float
     metalness_strength: float
 
-@dataclass
+@dataclass( slots=True )
 class DXTF_EmissiveTexture:
     texture: str
     strength: tuple[float, float, float]
 
-@dataclass
+@dataclass( slots=True )
 class DXTF_Material:
     name: str
 
@@ -55,13 +58,18 @@ class DXTF_Material:
         src: DXSpec_Material,
         tex: DXSpec_Mat2TextureContainer
     ):
-        self.name = src.name
-        self.diffuse = DXTF_DiffuseTexture( tex.diffuse[self.name], src.diffuse.strength )
-        self.normal = DXTF_NormalTexture( tex.normal[self.name], src.normal.scale )
-        self.orm = DXTF_ORMTexture( tex.orm[self.name], src.orm.occlusion.strength, src.orm.roughness.strength, src.orm.metalness.strength )
-
-        if src.emissive:
-            self.emissive = DXTF_EmissiveTexture( tex.emissive[self.name], src.emissive.factor )
+        name = src.name
+        orm = src.orm
+        emissive = src.emissive
+        diffuse_tex, normal_tex, orm_tex, emissive_tex = tex.get_all( name )
+
+        self.name = name
+        self.diffuse = DXTF_DiffuseTexture( diffuse_tex, src.diffuse.strength )
+        self.normal = DXTF_NormalTexture( normal_tex, src.normal.scale )
+        self.orm = DXTF_ORMTexture( orm_tex, orm.occlusion.strength, orm.roughness.strength, orm.metalness.strength )
+
+        if emissive:
+            self.emissive = DXTF_EmissiveTexture( emissive_tex, emissive.factor )
         else:
             self.emissive = None
 
@@ -70,13 +78,32 @@ class DXTF_Material:
         self.double_sided = src.double_sided
 
     def as_dict( self ):
-        out = asdict( self )
+        diffuse = self.diffuse
+        normal = self.normal
+        orm = self.orm
+        emissive = self.emissive
+
+        out = {
+            'name': self.name,
+            'diffuse': { 'texture': diffuse.texture, 'strength': list( diffuse.strength ) },
+            'normal': { 'texture': normal.texture, 'strength': normal.strength },
+            'orm': {
+                'texture': orm.texture,
+                'occlusion_strength': orm.occlusion_strength,
+                'roughness_strength': orm.roughness_strength,
+                'metalness_strength': orm.metalness_strength,
+            },
+        }
+
+        if emissive is not None:
+            out['emissive'] = { 'texture': emissive.texture, 'strength': list( emissive.strength ) }
 
-        if self.emissive is None:
-            out.pop( 'emissive' )
+        out['blend_mode'] = self.blend_mode
 
-        if self.blend_mode != 'MASK':
-            out.pop( 'alpha_cutoff' )
+        if self.blend_mode == 'MASK':
+            out['alpha_cutoff'] = self.alpha_cutoff
+
+        out['double_sided'] = self.double_sided
 
         return out
 
@@ -113,16 +140,19 @@ class DXTF_Material:
 
         validator = get_validator( 'dxtf_mat.schema.json' )
 
-        for mat in dxtf_materials_db:
+        def write_material( mat: 'DXTF_Material' ):
             mat_path = os.path.join( dx_materials_path, mat.name + '.dxtf_mat' )
-            with open( mat_path, 'w', encoding='utf-8' ) as f:
-                mat_dict = json.loads( json.dumps( mat.as_nameless_dict() ) )
-                validator.validate( mat_dict )
-                json.dump( mat_dict, f, indent=2 )
+            mat_dict = mat.as_nameless_dict()
+            validator.validate( mat_dict )
+            write_json( mat_path, mat_dict, indent=True )
+
+        # Each material is an independent file, so overlap the file I/O on a thread pool
+        with ThreadPoolExecutor( max_workers=min( 32, ( os.cpu_count() or 1 ) * 4 ) ) as executor:
+            list( executor.map( write_material, dxtf_materials_db ) )
 
         ezlog.info( f'Wrote {len(dxtf_materials_db)} DXTF materials!' )
 
-@dataclass
+@dataclass( slots=True )
 class DXTF_Tex2DDS:
     format: DDSFormat
     srgb: str # TODO: make literal
@@ -130,34 +160,40 @@ class DXTF_Tex2DDS:
     channels: list[tuple[Path | None, str]]
     resolution: tuple[int, int]
 
+    _output_path_str: str = field( repr=False, compare=False )
+    _channels_serialized: tuple[tuple[str | None, str], ...] = field( repr=False, compare=False )
+
     def __init__( self, texture_path: str, texture_key: DXSpec_TextureKey, out_path: str, srgb: str, invert_g: bool ):
         self.format = texture_key[1]
         self.output_path = Path( os.path.join( out_path, texture_path ) )
         self.resolution = texture_key[2]
         self.srgb = srgb
-        self.channels = []
-
-        for tex, swizzle in texture_key[0]:
-            for s in swizzle:
-                c = 'G' if ( s == 'g' and invert_g ) else s
-                self.channels.append( ( tex if s in 'rgba' else None, c ) )
+        self.channels = [
+            ( tex if s in 'rgba' else None, 'G' if ( s == 'g' and invert_g ) else s )
+            for tex, swizzle in texture_key[0]
+            for s in swizzle
+        ]
 
         expected_channels = format_get_channels( self.format )
+        actual_channels = len( self.channels )
 
-        if actual_channels := len( self.channels ) > expected_channels:
+        if actual_channels > expected_channels:
             raise ValueError( f'Format {self.format} requires {expected_channels} channels but got {actual_channels}!' )
 
-        while len( self.channels ) < expected_channels:
-            self.channels.append( ( None, '1' ) )
+        # Pad unused channels with constant ones
+        self.channels.extend( [ ( None, '1' ) ] * ( expected_channels - actual_channels ) )
+
+        # Precompute the serialized paths, as_dict is on the JSON serialization path
+        self._output_path_str = to_posix( str( self.output_path ) )
+        self._channels_serialized = tuple( ( to_posix( str( f ) ) if f else None, s ) for f, s in self.channels )
 
     def as_dict( self ):
         return {
-            'output_path': str( self.output_path ).replace( '\\', '/' ),
+            'output_path': self._output_path_str,
             'srgb': self.srgb,
             'format': self.format,
             'resolution': list( self.resolution ),
-            'channels': [ { 'file': str( f ).replace( '\\', '/' ) if f else None, 'src': s } for f, s in self.channels ],
-
+            'channels': [ { 'file': f, 'src': s } for f, s in self._channels_serialized ],
         }
 
     def as_nameless_dict( self ):
@@ -173,22 +209,12 @@ class DXTF_Tex2DDS:
         tex2dds_settings: dict,
         verbose: bool
     ) -> list['DXTF_Tex2DDS']:
-        str2key = dxspec_texture_outs_db.str2key
-
         ezlog.info( 'Creating DDS texture database' )
 
-        dxtf_tex2dds_db: list[DXTF_Tex2DDS] = []
-        for texture_outs, key in [
-            ( str2key.diffuse, 'diffuse' ),
-            ( str2key.normal, 'normal' ),
-            ( str2key.orm, 'orm' ),
-            ( str2key.emissive, 'emissive' )
-        ]:
-            for k, v in texture_outs.items():
-                if '$' in k:
-                    ezlog.warning( f'Skipping creation of DXTF_Tex2DDS for "{k}"' )
-                else:
-                    dxtf_tex2dds_db.append( cls( k, v, dx_textures_path, tex2dds_settings[key]['srgb'], tex2dds_settings[key].get( 'invert_g', False ) ) )
+        dxtf_tex2dds_db: list[DXTF_Tex2DDS] = [
+            cls( k, v, dx_textures_path, srgb, invert_g )
+            for k, v, srgb, invert_g in dxspec_texture_outs_db.iter_tex2dds_inputs( tex2dds_settings )
+        ]
 
         if verbose:
             ezlog.debug( 'DDS textures:', dxtf_tex2dds_db )
@@ -196,6 +222,22 @@ class DXTF_Tex2DDS:
 
         return dxtf_tex2dds_db
 
+    @staticmethod
+    def _is_closed_pipe( e: OSError ) -> bool:
+        # Like Popen._stdin_write, Windows raises EINVAL rather than EPIPE once the child has exited
+        return isinstance( e, BrokenPipeError ) or e.errno == errno.EINVAL
+
+    @classmethod
+    def _discard_stdin( cls, process: subprocess.Popen ):
+        # Close stdin ourselves, dropping any bytes still buffered for a dead pipe, so Popen.__exit__ only waits
+        assert process.stdin is not None
+        try:
+            process.stdin.close()
+        except OSError as e:
+            if not cls._is_closed_pipe( e ):
+                raise
+        process.stdin = None
+
     @classmethod
     def write_textures( cls, dxtf_tex2dds_db: list['DXTF_Tex2DDS'], dx_textures_path: str, verbose: bool ):
         ezlog.info( f'Writing DDS textures to: "{dx_textures_path}"' )
@@ -203,22 +245,41 @@ class DXTF_Tex2DDS:
 
         validator = get_validator( 'tex2dds.schema.json' )
 
-        textures = []
-        for tex in dxtf_tex2dds_db:
-            tex_dict = tex.as_dict()
-            validator.validate( tex_dict )
-            textures.append( tex_dict )
-
         arguments = [ 'tex2dds.exe' ]
 
         if verbose:
             arguments.append( '-v' )
 
-        subprocess.run(
+        # Stream the JSON array to tex2dds one texture at a time rather than serialising it up front
+        with subprocess.Popen(
             arguments,
-            input=json.dumps( textures ),
-            check=True,
-            text=True,
+            stdin=subprocess.PIPE,
             stdout=None if verbose else subprocess.DEVNULL
-        )
+        ) as process:
+            assert process.stdin is not None
+            try:
+                process.stdin.write( b'[' )
+                for i, tex in enumerate( dxtf_tex2dds_db ):
+                    tex_dict = tex.as_dict()
+                    validator.validate( tex_dict )
+                    if i > 0:
+                        process.stdin.write( b',' )
+                    process.stdin.write( orjson.dumps( tex_dict ) )
+                process.stdin.write( b']' )
+                process.stdin.close()
+            except OSError as e:
+                if not cls._is_closed_pipe( e ):
+                    process.kill()
+                    cls._discard_stdin( process )
+                    raise
+                # tex2dds exited early, its return code is checked below
+                cls._discard_stdin( process )
+            except BaseException:
+                process.kill()
+                cls._discard_stdin( process )
+                raise
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError( process.returncode, arguments )
+
         ezlog.info( f'Wrote {len(dxtf_tex2dds_db)} DDS textures!' )
@@ -4,31 +4,31 @@ from typing import Optional
 from gltf_conv.utils import init
 
 
-@dataclass
+@dataclass( slots=True )
 class GLTF_TextureInfo:
     index: int
 
     def __init__( self, obj: dict ):
         self.index = obj[ 'index' ]
 
-@dataclass
+@dataclass( slots=True )
 class GLTF_NormalTexture( GLTF_TextureInfo ):
     scale: float
 
     def __init__( self, obj: dict ):
-        super().__init__( obj )
+        GLTF_TextureInfo.__init__( self, obj )
         self.scale = obj.get( 'scale', 1.0 )
 
 
-@dataclass
+@dataclass( slots=True )
 class GLTF_OcclusionTexture( GLTF_TextureInfo ):
     strength: float
 
     def __init__( self, obj: dict ):
-        super().__init__( obj )
+        GLTF_TextureInfo.__init__( self, obj )
         self.strength = obj.get( 'strength', 1.0 )
 
-@dataclass
+@dataclass( slots=True )
 class GLTF_PBRMetallicRoughness:
     base_color_factor: tuple[float, float, float, float]
     base_color_texture: Optional[GLTF_TextureInfo]
@@ -45,7 +45,7 @@ class GLTF_PBRMetallicRoughness:
         self.roughness_factor = init( float, obj, 'roughnessFactor' )
         self.metallic_roughness_texture = init( GLTF_TextureInfo, obj, 'metallicRoughnessTexture' )
 
-@dataclass
+@dataclass( slots=True )
 class GLTF_Material:
     name: str
     pbr_metallic_roughness: Optional[GLTF_PBRMetallicRoughness]
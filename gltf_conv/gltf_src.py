@@ -1,23 +1,35 @@
-import copy
-import json
+import mmap
 import os
 from pathlib import Path
 import subprocess
 
-from gltf_conv.utils import ezlog
+import orjson
+
+from gltf_conv.utils import ezlog, to_posix
 
 
 # .\gltfpack.exe -i .\NewSponza_Main_glTF_003.gltf -o .\NewSponza_Main_glTF_003_comp.gltf -km -ke -tr -v -vtf -se 0.001 -si 0.5 -slb
 # .\gltfpack.exe -i .\NewSponza_Curtains_glTF.gltf -o .\NewSponza_Curtains_glTF_comp.gltf -km -ke -tr -v -vtf -se 0.001 -si 0.5 -slb
 
+# Files at least this large are memory mapped rather than read into a bytes copy
+_MMAP_THRESHOLD = 1 << 20
+
+def _load_json( path: str ) -> dict:
+    with open( path, 'rb' ) as f:
+        if os.name == 'nt' or os.fstat( f.fileno() ).st_size < _MMAP_THRESHOLD:
+            return orjson.loads( f.read() )
+
+        with mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) as buf, memoryview( buf ) as view:
+            return orjson.loads( view )
+
 class GLTFSrc:
     def __init__( self, src_dir: str, src: dict, verbose: bool ):
         self.file = src[ 'file' ]
         self.name = src.get( 'name', self.file )
         self.src_dir = src_dir
 
-        inp = os.path.join( src_dir, self.file + '.gltf' ).replace( '\\', '/' )
-        out = os.path.join( src_dir, self.file + '.comp.gltf' ).replace( '\\', '/' )
+        inp = to_posix( os.path.join( src_dir, self.file + '.gltf' ) )
+        out = to_posix( os.path.join( src_dir, self.file + '.comp.gltf' ) )
 
         args = [
             'gltfpack.exe',
@@ -49,8 +61,7 @@ class GLTFSrc:
         else:
             raise ValueError( f'gltfpack.exe returned with error code {ret.returncode}')
 
-        with open( out, encoding='utf-8' ) as f:
-            self.data = json.load( f )
+        self.data = _load_json( out )
 
     @property
     def src_materials( self ) -> list[dict]:
@@ -72,18 +83,12 @@ class GLTFSrc:
         return Path( os.path.join( self.src_dir, image_uri ) )
 
     def as_dxtf( self ):
-        dxtf = copy.deepcopy( self.data )
-
-        dxtf.pop( 'textures', None )
-        dxtf.pop( 'images', None )
-        dxtf.pop( 'samples', None )
+        # Shallow rebuild, only the replaced entries are new objects and the rest is shared with self.data
+        dxtf = { k: v for k, v in self.data.items() if k not in ( 'textures', 'images', 'samples' ) }
 
-        for b in dxtf[ 'buffers' ]:
-            b[ 'uri' ] = b[ 'uri' ].replace( '.comp.bin', '.dxtf_mdl' )
+        dxtf[ 'buffers' ] = [ { **b, 'uri': b[ 'uri' ].replace( '.comp.bin', '.dxtf_mdl' ) } for b in self.data[ 'buffers' ] ]
 
-        for mat in dxtf[ 'materials' ]:
-            for k in list( mat.keys() ):
-                if k != 'name':
-                    mat.pop( k )
+        # Keep only the material names, unnamed materials (not yet named by GLTF_Material) become empty
+        dxtf[ 'materials' ] = [ { 'name': mat[ 'name' ] } if 'name' in mat else {} for mat in self.data[ 'materials' ] ]
 
         return dxtf
@@ -1,7 +1,10 @@
+import functools
 import importlib.resources as resources
-import json
+import os
 
+import fastjsonschema
 from jsonschema import validators
+import orjson
 from referencing import Registry, Resource
 
 import gltf_conv.schemas as schemas
@@ -9,13 +12,51 @@ import gltf_conv.schemas as schemas
 def _create_registry():
     schema_store: dict[str, dict] = {}
     for r in resources.files( schemas ).iterdir():
-        with r.open() as f:
-            s = json.load( f )
-            schema_store[s['$id']] = s
+        if not r.name.endswith( '.json' ):
+            continue
+        s = orjson.loads( r.read_bytes() )
+        schema_store[s['$id']] = s
     return Registry( { k: Resource.from_contents( v ) for k, v in schema_store.items() } )
 
 _SCHEMA_REGISTRY = _create_registry()
 
+# Set GLTF_CONV_SLOW_VALIDATE=1 to validate with jsonschema directly, e.g. when debugging schemas
+_SLOW_VALIDATE = os.environ.get( 'GLTF_CONV_SLOW_VALIDATE', '0' ) == '1'
+
+@functools.lru_cache( maxsize=None )
+def _get_jsonschema_validator( schema: str ):
+    contents = _SCHEMA_REGISTRY[schema].contents
+    ValidatorClass = validators.validator_for( contents )
+    ValidatorClass.check_schema( contents )
+    return ValidatorClass( contents, registry=_SCHEMA_REGISTRY )
+
+class FastValidator:
+    """ Schema validator compiled with fastjsonschema, falling back to jsonschema for descriptive errors """
+
+    def __init__( self, schema: str ):
+        self.schema = schema
+        self._compiled = fastjsonschema.compile(
+            _SCHEMA_REGISTRY[schema].contents,
+            handlers={ '': lambda uri: _SCHEMA_REGISTRY[uri].contents },
+            use_default=False
+        )
+
+    def validate( self, instance ):
+        try:
+            self._compiled( instance )
+        except fastjsonschema.JsonSchemaException:
+            # Re-run the jsonschema validator to raise its more descriptive error
+            _get_jsonschema_validator( self.schema ).validate( instance )
+            raise
+
+def _create_validators():
+    create_validator = _get_jsonschema_validator if _SLOW_VALIDATE else FastValidator
+    return { schema: create_validator( schema ) for schema in _SCHEMA_REGISTRY }
+
+_VALIDATORS = _create_validators()
+
 def get_validator( schema: str ):
-    ValidatorClass = validators.validator_for( _SCHEMA_REGISTRY[schema].contents )
-    return ValidatorClass( _SCHEMA_REGISTRY[schema].contents, registry=_SCHEMA_REGISTRY )
\ No newline at end of file
+    return _VALIDATORS[schema]
+
+def validate( schema: str, instance ):
+    get_validator( schema ).validate( instance )
@@ -1,5 +1,8 @@
 from typing import Literal, Sequence, Type, TypeGuard, TypeVar, Mapping
-import copy
+import operator
+import os
+import shutil
+import orjson
 import rich
 
 BlendModes = Literal['OPAQUE', 'MASK', 'BLEND']
@@ -12,22 +15,22 @@ DDSFormat = Literal[
     'BC7_UNORM', 'BC7_UNORM_SRGB'
 ]
 
-def format_get_channels( f: DDSFormat ):
-    match f[:3]:
-        case 'BC1': return 4
-        case 'BC3': return 4
-        case 'BC4': return 1
-        case 'BC5': return 2
-        case 'BC6': return 3
-        case 'BC7': return 4
+# Number of channels for each BC format family
+_BC_CHANNELS = { 'BC1': 4, 'BC3': 4, 'BC4': 1, 'BC5': 2, 'BC6': 3, 'BC7': 4 }
+
+_BC1_FORMATS = ( 'BC1_UNORM', 'BC1_UNORM_SRGB' )
 
-    raise ValueError( f'Unknow BC format {f}' )
+def format_get_channels( f: DDSFormat ):
+    try:
+        return _BC_CHANNELS[ f[:3] ]
+    except KeyError:
+        raise ValueError( f'Unknow BC format {f}' ) from None
 
 def format_get_srgb( f: DDSFormat ):
-    return f[-4:] == 'SRGB'
+    return f.endswith( 'SRGB' )
 
 def format_requires_alpha_cuttoff( f: DDSFormat, blend_mode: BlendModes ):
-    return f[:3] == 'BC1' and blend_mode == 'MASK'
+    return f in _BC1_FORMATS and blend_mode == 'MASK'
 
 
 def is_numeric(obj: object) -> TypeGuard[int | float]:
@@ -41,8 +44,8 @@ def _modulate( original, modulator ) :
     if not isinstance( modulator, dict ):
         return modulator
 
-    op = modulator.pop( 'op' )
-    value = modulator.pop( 'value' )
+    op = modulator[ 'op' ]
+    value = modulator[ 'value' ]
 
     if op not in [ 'mult', 'add' ]:
         raise ValueError( f'Unknown operator {op}!' )
@@ -67,8 +70,8 @@ def _modulate( original, modulator ) :
 
     if is_numeric_sequence( original ) and is_numeric( value ):
         match op:
-            case 'mult': return tuple( o * value for o in original )
-            case 'add': return tuple( o + value for o in original )
+            case 'mult': return tuple( [ o * value for o in original ] )
+            case 'add': return tuple( [ o + value for o in original ] )
             case _: assert False
 
     if is_numeric_sequence( original ) and is_numeric_sequence( value ):
@@ -76,8 +79,8 @@ def _modulate( original, modulator ) :
             raise ValueError( f'Original tuple "{original}" and value tuple "{value}" must be equal length!' )
 
         match op:
-            case 'mult': return tuple( o * v for o, v in zip( original, value ) )
-            case 'add': return tuple( o + v for o, v in zip( original, value ) )
+            case 'mult': return tuple( map( operator.mul, original, value ) )
+            case 'add': return tuple( map( operator.add, original, value ) )
             case _: assert False
 
     assert False
@@ -99,36 +102,115 @@ def init( cls: Type[T], obj: dict, key: str, default: T | None = None ) -> T | N
         return cls( obj[ key ] ) # type: ignore
     return default
 
+# Log verbosity set through GLTF_CONV_LOG, by number or name: 0 = error, 1 = warning, 2 = info, 3 = debug (default)
+_LEVEL_NAMES = { 'error': 0, 'warning': 1, 'info': 2, 'debug': 3 }
+
+def _parse_level( value: str ) -> int | None:
+    value = value.strip().lower()
+    if value in _LEVEL_NAMES:
+        return _LEVEL_NAMES[ value ]
+    try:
+        return min( max( int( value ), 0 ), 3 )
+    except ValueError:
+        return None
+
+_LEVEL_ENV = os.environ.get( 'GLTF_CONV_LOG' ) or '3'
+_PARSED_LEVEL = _parse_level( _LEVEL_ENV )
+_LEVEL = 3 if _PARSED_LEVEL is None else _PARSED_LEVEL
+
 class ezlog:
     @staticmethod
     def debug( *args ):
-        rich.print( '[bold cyan]DEBUG:[/bold cyan]', *args, flush=True )
+        if _LEVEL < 3:
+            return
+        rich.print( '[bold cyan]DEBUG:[/bold cyan]', *args )
 
     @staticmethod
     def info( *args ):
-        rich.print( '[bold green]INFO:[/bold green]', *args, flush=True )
+        if _LEVEL < 2:
+            return
+        rich.print( '[bold green]INFO:[/bold green]', *args )
 
     @staticmethod
     def warning( *args ):
-        rich.print( '[bold yellow]WARNING:[/bold yellow]', *args, flush=True )
+        if _LEVEL < 1:
+            return
+        rich.print( '[bold yellow]WARNING:[/bold yellow]', *args )
 
     @staticmethod
     def error( *args ):
         rich.print( '[bold red]ERROR:[/bold red]', *args, flush=True )
 
+if _PARSED_LEVEL is None:
+    ezlog.warning( f'Unknown GLTF_CONV_LOG level "{_LEVEL_ENV}", expected 0-3 or one of {list( _LEVEL_NAMES )}. Defaulting to debug!' )
+
+def to_posix( path: str ) -> str:
+    """ Converts Windows path separators to '/' on every platform, as config paths may use either """
+    return path.replace( '\\', '/' )
+
+def write_json( path: str, obj, indent: bool = False ):
+    """ Writes obj to path as JSON using orjson """
+    with open( path, 'wb' ) as f:
+        f.write( orjson.dumps( obj, option=orjson.OPT_INDENT_2 if indent else None ) )
+
+def copy_file( src: str, dst: str ):
+    """ Copies the contents of src to dst, in-kernel with copy_file_range where supported (reflinking on CoW file systems) """
+    # Opening dst truncates it, which would also empty src if both are the same file
+    if os.path.exists( dst ) and os.path.samefile( src, dst ):
+        raise shutil.SameFileError( f'{src!r} and {dst!r} are the same file' )
+
+    if hasattr( os, 'copy_file_range' ):
+        try:
+            with open( src, 'rb' ) as fsrc, open( dst, 'wb' ) as fdst:
+                remaining = os.fstat( fsrc.fileno() ).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range( fsrc.fileno(), fdst.fileno(), remaining )
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                return
+        except OSError:
+            pass
+
+    # Fallback, which uses sendfile where available
+    shutil.copyfile( src, dst )
+
+def json_clone( obj ):
+    """
+    Clones a JSON tree as produced by `json.load`.
+    - dicts and lists are copied recursively
+    - all other values are immutable scalars and are shared
+    """
+    if isinstance( obj, dict ):
+        return { k: json_clone( v ) for k, v in obj.items() }
+    if isinstance( obj, list ):
+        return [ json_clone( v ) for v in obj ]
+    return obj
+
 def recursive_overwrite(A: dict, B: Mapping) -> dict:
     """
     Overwrites A with keys/values from B recursively.
     - If both A[k] and B[k] are dicts -> recurse
-    - Otherwise -> overwrite A[k] with a deep copy of B[k]
+    - Otherwise -> overwrite A[k] with B[k] itself, so B must be treated as read-only afterwards
     """
-    for k, v in B.items():
-        if (
-            k in A
-            and isinstance(A[k], Mapping)
-            and isinstance(v, Mapping)
-        ):
-            recursive_overwrite(A[k], v)
-        else:
-            A[k] = copy.deepcopy(v)
+    # Walk with an explicit stack of (dst, src) pairs rather than recursing
+    stack: list[tuple[dict, Mapping]] = [ ( A, B ) ]
+    while stack:
+        dst, src = stack.pop()
+
+        # Leaf level overrides can be applied in a single update
+        if not any( isinstance( v, Mapping ) for v in src.values() ):
+            dst.update( src )
+            continue
+
+        for k, v in src.items():
+            if (
+                k in dst
+                and isinstance(dst[k], Mapping)
+                and isinstance(v, Mapping)
+            ):
+                stack.append( ( dst[k], v ) )
+            else:
+                dst[k] = v
     return A
@@ -27,7 +27,9 @@ setup(
     },
     install_requires=[
         "rich",
-        "jsonschema"
+        "jsonschema",
+        "fastjsonschema",
+        "orjson>=3.10"
     ],
     entry_points={
         "console_scripts": [